@@ -0,0 +1,248 @@
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import pathlib
+import weakref
+from pdf_processor import PDFProcessor
+from output_layout import PageIndex
+
+
+class ConversionCancelled(Exception):
+    """変換がページの区切りで中断されたことを示す例外"""
+
+
+def _convert_in_process(pdf_path, output_folder, dpi, page_range, layout, with_index, events, cancel_event):
+    """
+    ワーカープロセスでPDFを変換し、保存したページをキューで親プロセスに通知
+
+    PyMuPDFは複数スレッドからの同時利用に対応していないため、変換は必ず
+    プロセスごとに1件ずつ実行します。
+
+    Returns:
+        int: 変換されたページ数
+    """
+    base_name = pathlib.Path(pdf_path).stem
+    index = PageIndex(output_folder, layout) if with_index else None
+
+    def on_page(page_num, output_path):
+        if index is not None:
+            # 索引への登録は親プロセスで行うため、計算済みの [サイズ, チェックサム] を送る
+            document = index.documents[base_name]
+            events.put((page_num, output_path, document['page_count'], document['pages'][page_num]))
+        else:
+            events.put((page_num, output_path, None, None))
+
+        # 次のページに進む前に中断要求を確認する
+        if cancel_event.is_set():
+            raise ConversionCancelled()
+
+    try:
+        return PDFProcessor.pdf_to_png(
+            pdf_path,
+            output_folder,
+            dpi=dpi,
+            page_range=page_range,
+            page_callback=on_page,
+            layout=layout,
+            index=index
+        )
+    finally:
+        events.put(None)
+
+
+class AsyncConverter:
+    """asyncioアプリケーションからPDF→PNG変換を行うクラス
+
+    変換処理はワーカープロセス（デフォルトは max_concurrency 個のプロセスプール）で
+    実行されるため、イベントループを止めず、複数の変換を並列に処理できます。
+    同時に実行する変換の数はインスタンスとイベントループの組ごとに
+    max_concurrency で制限されます。使い終わったら close() でワーカープロセスを
+    終了してください。
+
+    使用例:
+        converter = AsyncConverter(max_concurrency=2)
+        try:
+            page_count = await converter.convert("a.pdf", "output")
+
+            async with contextlib.aclosing(converter.iter_pages("b.pdf", "output")) as pages:
+                async for page_num, output_path in pages:
+                    print(page_num, output_path)
+        finally:
+            converter.close()
+    """
+
+    def __init__(self, max_concurrency=2, executor=None, dpi=150, layout=None):
+        """
+        Args:
+            max_concurrency (int): 同時に実行する変換の最大数（デフォルト2）
+            executor (concurrent.futures.ProcessPoolExecutor): 変換を実行するプロセスプール
+                （デフォルトは初回使用時に作成。PyMuPDFはスレッドからの同時利用に対応していないため、
+                スレッドプールは指定しないでください）
+            dpi (int): 解像度（デフォルト150）
+            layout (OutputLayout): 出力ファイルの配置（デフォルトは出力先フォルダ直下）
+        """
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.dpi = dpi
+        self.layout = layout
+        self._owns_executor = executor is None
+        self._manager = None
+        # セマフォは最初に使ったイベントループに結び付くため、ループごとに作成する
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def convert(self, pdf_path, output_folder, page_range=None, index=None):
+        """
+        PDFファイルを連番PNG画像に変換
+
+        タスクがキャンセルされた場合は、変換中のページの保存が終わった時点で中断します。
+
+        Args:
+            pdf_path (str): PDFファイルのパス
+            output_folder (str): 出力先フォルダ
+            page_range (tuple): 変換するページ範囲 (開始, 終了)。0始まり・終了は含まない
+            index (PageIndex): 保存したページを登録する索引（保存は呼び出し側で行う）
+
+        Returns:
+            int: 変換されたページ数
+        """
+        page_count = 0
+        async for _ in self.iter_pages(pdf_path, output_folder, page_range=page_range, index=index):
+            page_count += 1
+        return page_count
+
+    async def iter_pages(self, pdf_path, output_folder, page_range=None, index=None):
+        """
+        PDFファイルを変換し、保存が完了したページを順に返す非同期イテレーター
+
+        タスクがキャンセルされた場合やイテレーターを閉じた場合は、変換中のページの
+        保存が終わった時点で変換を中断し、ワーカープロセスの処理が終わるのを待ってから
+        同時実行数の枠を解放します。
+
+        `async for` を break で抜けただけではイテレーターはすぐには閉じられず、
+        ガベージコレクションで回収されるまで変換と同時実行数の枠が残ります。
+        途中で抜ける場合は `contextlib.aclosing()`（Python 3.10以降）で囲むか、
+        `aclose()` を明示的に呼び出してください。
+
+        Args:
+            pdf_path (str): PDFファイルのパス
+            output_folder (str): 出力先フォルダ
+            page_range (tuple): 変換するページ範囲 (開始, 終了)。0始まり・終了は含まない
+            index (PageIndex): 保存したページを登録する索引（保存は呼び出し側で行う）
+
+        Yields:
+            tuple: (page_num, output_path)。page_numは0始まり
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+
+        async with semaphore:
+            manager = self._get_manager()
+            events = manager.Queue()
+            cancel_event = manager.Event()
+            base_name = pathlib.Path(pdf_path).stem
+
+            future = loop.run_in_executor(self._get_executor(), functools.partial(
+                _convert_in_process,
+                pdf_path,
+                output_folder,
+                self.dpi,
+                page_range,
+                self.layout,
+                index is not None,
+                events,
+                cancel_event
+            ))
+
+            try:
+                while True:
+                    # キューの受信は待機するだけなので、イベントループ標準のスレッドプールで行う
+                    item = await loop.run_in_executor(None, events.get)
+                    if item is None:
+                        # 変換中の例外はここで呼び出し側に伝わる
+                        await future
+                        return
+
+                    page_num, output_path, page_count, entry = item
+                    if index is not None:
+                        index.add_entry(base_name, page_num, page_count, entry)
+                    yield page_num, output_path
+            finally:
+                cancel_event.set()
+                if not future.done():
+                    await asyncio.wait([future])
+                if not future.cancelled():
+                    # 中断による例外を取得済みにして、未処理例外の警告を出さないようにする
+                    future.exception()
+                # 受信待ちのまま残ったスレッドがあれば終了させる
+                events.put(None)
+
+    def close(self):
+        """このインスタンスが作成したワーカープロセスを終了"""
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def _get_executor(self):
+        """変換を実行するプロセスプールを取得（初回使用時に作成）"""
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_concurrency)
+        return self.executor
+
+    def _get_manager(self):
+        """ワーカープロセスとの通知に使うキューとイベントの管理プロセスを取得（初回使用時に作成）"""
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager
+
+
+async def convert(pdf_path, output_folder, dpi=150, page_range=None, layout=None, index=None,
+                  executor=None):
+    """
+    PDFファイルを連番PNG画像に変換（AsyncConverter.convertの簡易版）
+
+    呼び出しごとにワーカープロセスを起動するため、繰り返し変換する場合は
+    AsyncConverterを使い回してください。
+
+    Args:
+        pdf_path (str): PDFファイルのパス
+        output_folder (str): 出力先フォルダ
+        dpi (int): 解像度（デフォルト150）
+        page_range (tuple): 変換するページ範囲 (開始, 終了)。0始まり・終了は含まない
+        layout (OutputLayout): 出力ファイルの配置
+        index (PageIndex): 保存したページを登録する索引
+        executor (concurrent.futures.ProcessPoolExecutor): 変換を実行するプロセスプール
+
+    Returns:
+        int: 変換されたページ数
+    """
+    converter = AsyncConverter(max_concurrency=1, executor=executor, dpi=dpi, layout=layout)
+    try:
+        return await converter.convert(pdf_path, output_folder, page_range=page_range, index=index)
+    finally:
+        converter.close()
+
+
+async def iter_pages(pdf_path, output_folder, dpi=150, page_range=None, layout=None, index=None,
+                     executor=None):
+    """
+    保存が完了したページを順に返す非同期イテレーター（AsyncConverter.iter_pagesの簡易版）
+
+    途中で抜ける場合は `contextlib.aclosing()` で囲むか、`aclose()` を呼び出してください。
+
+    Yields:
+        tuple: (page_num, output_path)。page_numは0始まり
+    """
+    converter = AsyncConverter(max_concurrency=1, executor=executor, dpi=dpi, layout=layout)
+    try:
+        async for item in converter.iter_pages(pdf_path, output_folder, page_range=page_range, index=index):
+            yield item
+    finally:
+        converter.close()
@@ -0,0 +1,545 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import time
+import uuid
+from pdf_processor import PDFProcessor
+from output_layout import OutputLayout, PageIndex
+
+
+class LeaseLostError(Exception):
+    """処理中の作業単位のリースが他のワーカーに引き継がれたことを示す例外"""
+
+
+class ShardedBatch:
+    """共有フォルダ上のジョブマニフェストを使い、複数のワーカー（プロセス・ノード）で変換を分担するクラス
+
+    ジョブフォルダの構成:
+        job.json            ジョブ全体の設定（出力先、解像度、出力配置、リース期間）
+        units/<id>.json     作業単位（PDFファイルとページ範囲）
+        leases/<id>/<n>     作業単位のリース（世代nが最大のものが有効）
+        done/<id>.json      完了した作業単位の記録（出力したページの索引情報を含む）
+
+    外部のコーディネーターは不要で、排他制御はファイルの排他作成（O_EXCL）、
+    ハードリンクによる排他的な公開、アトミックなリネームだけで行います。リースの期限判定には各ノードの時刻を
+    使うため、ノード間の時計は同期しておく必要があります。
+    """
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self.units_dir = os.path.join(job_dir, "units")
+        self.leases_dir = os.path.join(job_dir, "leases")
+        self.done_dir = os.path.join(job_dir, "done")
+
+    def create(self, pdf_paths, output_folder, pages_per_unit=20, dpi=150, lease_seconds=300,
+               layout=None):
+        """
+        PDFファイル群を (ファイル, ページ範囲) の作業単位に分割してマニフェストを作成
+
+        Args:
+            pdf_paths (list): PDFファイルのパスのリスト
+            output_folder (str): 出力先フォルダ（全ワーカーから見える共有パス）
+            pages_per_unit (int): 1作業単位あたりのページ数（デフォルト20）
+            dpi (int): 解像度（デフォルト150）
+            lease_seconds (int): リースの有効期間（秒、デフォルト300）
+            layout (OutputLayout): 出力ファイルの配置（デフォルトは出力先フォルダ直下）
+
+        Returns:
+            int: 作成された作業単位の数
+
+        Raises:
+            FileExistsError: ジョブフォルダに既にマニフェストまたは作業単位がある場合
+            ValueError: 1作業単位あたりのページ数が1未満の場合、または無効なPDFファイルが含まれている場合
+        """
+        if os.path.exists(os.path.join(self.job_dir, "job.json")):
+            raise FileExistsError(f"ジョブは既に作成されています: {self.job_dir}")
+
+        if os.path.isdir(self.units_dir) and self._unit_ids():
+            raise FileExistsError(f"ジョブフォルダに以前の作業単位が残っています: {self.units_dir}")
+
+        if pages_per_unit < 1:
+            raise ValueError(f"1作業単位あたりのページ数は1以上を指定してください: {pages_per_unit}")
+
+        # 途中で失敗してもジョブフォルダが中途半端に残らないよう、先にすべてのPDFを確認する
+        documents = []
+        for pdf_path in pdf_paths:
+            pdf_path = os.path.abspath(pdf_path)
+            is_valid, error_msg = PDFProcessor.validate_pdf(pdf_path)
+            if not is_valid:
+                raise ValueError(f"{os.path.basename(pdf_path)}: {error_msg}")
+            documents.append((pdf_path, PDFProcessor.get_pdf_info(pdf_path)['page_count']))
+
+        for dir_path in (self.units_dir, self.leases_dir, self.done_dir):
+            os.makedirs(dir_path, exist_ok=True)
+
+        unit_count = 0
+        for file_index, (pdf_path, page_count) in enumerate(documents):
+            for start in range(0, page_count, pages_per_unit):
+                unit_id = f"{file_index:05d}-{start:07d}"
+                self._write_json(os.path.join(self.units_dir, f"{unit_id}.json"), {
+                    'id': unit_id,
+                    'pdf_path': pdf_path,
+                    'page_range': [start, min(start + pages_per_unit, page_count)]
+                })
+                unit_count += 1
+
+        # job.jsonは最後に書き込み、ワーカーが作成途中のジョブを処理しないようにする
+        self._write_json(os.path.join(self.job_dir, "job.json"), {
+            'output_folder': os.path.abspath(output_folder),
+            'dpi': dpi,
+            'layout': (layout or OutputLayout()).to_dict(),
+            'lease_seconds': lease_seconds
+        })
+        return unit_count
+
+    def load_job(self):
+        """
+        ジョブ設定を読み込む
+
+        Returns:
+            dict: ジョブ設定
+
+        Raises:
+            FileNotFoundError: マニフェストが存在しない場合
+        """
+        job_path = os.path.join(self.job_dir, "job.json")
+        if not os.path.exists(job_path):
+            raise FileNotFoundError(f"ジョブが見つかりません: {self.job_dir}")
+        return self._read_json(job_path)
+
+    def claim(self, worker_id, skip_ids=()):
+        """
+        未完了かつリースされていない作業単位を1つ確保
+
+        Args:
+            worker_id (str): ワーカーの識別子
+            skip_ids (iterable): 確保の対象から除く作業単位のID
+
+        Returns:
+            tuple: (unit, lease_path)。確保できる作業単位がない場合は (None, None)
+        """
+        lease_seconds = self.load_job()['lease_seconds']
+
+        # ワーカーごとに走査の開始位置をずらし、先頭の作業単位に確保が集中しないようにする
+        pending_ids = self._pending_ids()
+        offset = random.randrange(len(pending_ids)) if pending_ids else 0
+
+        for unit_id in pending_ids[offset:] + pending_ids[:offset]:
+            if unit_id in skip_ids:
+                continue
+
+            generation, lease = self._current_lease(unit_id)
+            if lease is not None and lease['expires'] > time.time():
+                continue
+
+            # 次の世代のリースを排他作成できたワーカーだけが作業単位を得る
+            lease_path = self._lease_path(unit_id, generation + 1)
+            os.makedirs(os.path.dirname(lease_path), exist_ok=True)
+            if not self._create_exclusive(lease_path, {
+                'worker': worker_id,
+                'expires': time.time() + lease_seconds
+            }):
+                continue
+
+            # リース取得中に他のワーカーが完了させていた場合は譲る
+            if self.is_done(unit_id):
+                continue
+
+            return self._read_json(os.path.join(self.units_dir, f"{unit_id}.json")), lease_path
+
+        return None, None
+
+    def renew(self, lease_path, worker_id):
+        """
+        リースの有効期限を延長
+
+        Args:
+            lease_path (str): claim()で得たリースファイルのパス
+            worker_id (str): ワーカーの識別子
+
+        Returns:
+            bool: 延長できた場合はTrue、他のワーカーにリースを奪われていた場合はFalse
+        """
+        unit_id = os.path.basename(os.path.dirname(lease_path))
+        generation = int(os.path.basename(lease_path))
+        if self._current_lease(unit_id)[0] != generation:
+            return False
+
+        self._write_json(lease_path, {
+            'worker': worker_id,
+            'expires': time.time() + self.load_job()['lease_seconds']
+        })
+        return True
+
+    def process(self, unit, lease_path, worker_id):
+        """
+        作業単位を変換して結果をアトミックに確定
+
+        ページはまず出力先フォルダ内の作業用フォルダに保存し、すべて揃ってから
+        最終的なファイル名にリネームします。同じ作業単位が重複して処理されても
+        出力内容は同一なので、結果が壊れることはありません。リースの延長時や
+        出力先への移動の直前に他のワーカーへ引き継がれていた場合は、その時点で
+        処理を打ち切り、作業用フォルダの内容を破棄します。
+
+        Args:
+            unit (dict): claim()で得た作業単位
+            lease_path (str): claim()で得たリースファイルのパス
+            worker_id (str): ワーカーの識別子
+
+        Returns:
+            int: 変換されたページ数
+
+        Raises:
+            LeaseLostError: リースが他のワーカーに引き継がれていた場合
+        """
+        job = self.load_job()
+        output_folder = job['output_folder']
+        staging_folder = os.path.join(
+            output_folder, ".staging", f"{unit['id']}-{uuid.uuid4().hex}"
+        )
+        layout = OutputLayout.from_dict(job.get('layout'))
+        index = PageIndex(output_folder, layout)
+        renew_interval = job['lease_seconds'] / 2
+        last_renewed = [time.time()]
+
+        def on_page(page_num, output_path):
+            # リース期間の半分を過ぎたら延長する
+            if time.time() - last_renewed[0] >= renew_interval:
+                if not self.renew(lease_path, worker_id):
+                    raise LeaseLostError(f"リースが他のワーカーに引き継がれました: {unit['id']}")
+                last_renewed[0] = time.time()
+
+        try:
+            page_count = PDFProcessor.pdf_to_png(
+                unit['pdf_path'],
+                staging_folder,
+                dpi=job['dpi'],
+                page_range=tuple(unit['page_range']),
+                page_callback=on_page,
+                layout=layout,
+                index=index
+            )
+
+            # 変換中にリースが切れて他のワーカーが確定させた結果を上書きしないよう、移動の直前に確認する
+            if not self.renew(lease_path, worker_id) or self.is_done(unit['id']):
+                raise LeaseLostError(f"リースが他のワーカーに引き継がれました: {unit['id']}")
+
+            for dir_path, _, file_names in os.walk(staging_folder):
+                target_dir = os.path.join(output_folder, os.path.relpath(dir_path, staging_folder))
+                os.makedirs(target_dir, exist_ok=True)
+                for file_name in file_names:
+                    os.replace(
+                        os.path.join(dir_path, file_name),
+                        os.path.join(target_dir, file_name)
+                    )
+        finally:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(staging_folder))
+            except OSError:
+                # 他のワーカーが作業中の場合は残す
+                pass
+
+        # 索引の作成に使うため、出力したページの情報を完了記録に残す
+        documents = {
+            base_name: {
+                'page_count': document['page_count'],
+                'pages': [[page_num, entry] for page_num, entry in enumerate(document['pages']) if entry]
+            }
+            for base_name, document in index.documents.items()
+        }
+        self._publish_exclusive(os.path.join(self.done_dir, f"{unit['id']}.json"), {
+            'worker': worker_id,
+            'page_count': page_count,
+            'documents': documents,
+            'finished': time.time()
+        })
+        return page_count
+
+    def run_worker(self, worker_id=None, max_units=None):
+        """
+        作業単位がなくなるまで確保・変換を繰り返す
+
+        他のワーカーがリースを保持したまま停止した場合に備え、未完了の作業単位が
+        残っている間はリースの期限切れを待って再確保を試みます。すべての作業単位が
+        完了していれば、終了時に出力先フォルダの索引を作成します。
+
+        Args:
+            worker_id (str): ワーカーの識別子（省略時はホスト名とプロセスIDから生成）
+            max_units (int): 処理する作業単位の上限（デフォルトは無制限）
+
+        Returns:
+            tuple: (処理した作業単位数, エラーメッセージのリスト)
+        """
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+        processed_units = 0
+        failed_ids = set()
+        errors = []
+
+        while max_units is None or processed_units < max_units:
+            unit, lease_path = self.claim(worker_id, skip_ids=failed_ids)
+            if unit is None:
+                if not set(self._pending_ids()) - failed_ids:
+                    break
+                # 他のワーカーが処理中の作業単位のリース切れを待つ
+                time.sleep(1)
+                continue
+
+            try:
+                self.process(unit, lease_path, worker_id)
+                processed_units += 1
+            except LeaseLostError:
+                # 引き継いだワーカーに任せて次の作業単位に進む
+                continue
+            except Exception as e:
+                # リースは残し、期限切れ後に別のワーカーが再試行できるようにする
+                failed_ids.add(unit['id'])
+                errors.append(f"{os.path.basename(unit['pdf_path'])} {unit['page_range']}: {str(e)}")
+
+        if not self._pending_ids():
+            self.build_index()
+
+        return processed_units, errors
+
+    def build_index(self):
+        """
+        完了記録から出力先フォルダの索引（page_index.json）を作成
+
+        内容は完了記録だけで決まるため、複数のワーカーが同時に作成しても結果は同じです。
+        途中で停止したワーカーが残した作業用フォルダもここで削除します。
+
+        Returns:
+            PageIndex: 作成した索引
+        """
+        job = self.load_job()
+        self._remove_stale_staging(job['output_folder'], job['lease_seconds'])
+
+        index = PageIndex(job['output_folder'], OutputLayout.from_dict(job.get('layout')))
+        for name in sorted(os.listdir(self.done_dir)):
+            if not name.endswith(".json"):
+                continue
+            record = self._read_json(os.path.join(self.done_dir, name))
+            for base_name, document in record.get('documents', {}).items():
+                for page_num, entry in document['pages']:
+                    index.add_entry(base_name, page_num, document['page_count'], entry)
+
+        index.save()
+        return index
+
+    def is_done(self, unit_id):
+        """作業単位が完了しているかを確認"""
+        return os.path.exists(os.path.join(self.done_dir, f"{unit_id}.json"))
+
+    def status(self):
+        """
+        ジョブの進捗を取得
+
+        Returns:
+            dict: 作業単位の総数、完了数、リース中の数
+        """
+        unit_ids = self._unit_ids()
+        pending_ids = self._pending_ids()
+        leased = 0
+        for unit_id in pending_ids:
+            lease = self._current_lease(unit_id)[1]
+            if lease is not None and lease['expires'] > time.time():
+                leased += 1
+
+        return {
+            'total': len(unit_ids),
+            'done': len(unit_ids) - len(pending_ids),
+            'leased': leased
+        }
+
+    def _unit_ids(self):
+        """全作業単位のIDを取得"""
+        return sorted(
+            name[:-len(".json")] for name in os.listdir(self.units_dir)
+            if name.endswith(".json")
+        )
+
+    def _pending_ids(self):
+        """未完了の作業単位のIDを取得"""
+        done_ids = {
+            name[:-len(".json")] for name in os.listdir(self.done_dir)
+            if name.endswith(".json")
+        }
+        return [unit_id for unit_id in self._unit_ids() if unit_id not in done_ids]
+
+    @staticmethod
+    def _remove_stale_staging(output_folder, lease_seconds):
+        """リース期間を過ぎても更新されていない作業用フォルダを削除"""
+        staging_root = os.path.join(output_folder, ".staging")
+        if not os.path.isdir(staging_root):
+            return
+
+        for name in os.listdir(staging_root):
+            staging_folder = os.path.join(staging_root, name)
+            # ページを保存するとフォルダの更新時刻が変わるため、最も新しい時刻で判定する
+            try:
+                last_modified = max(
+                    os.path.getmtime(dir_path) for dir_path, _, _ in os.walk(staging_folder)
+                )
+            except ValueError:
+                continue
+            if time.time() - last_modified > lease_seconds:
+                shutil.rmtree(staging_folder, ignore_errors=True)
+
+        try:
+            os.rmdir(staging_root)
+        except OSError:
+            # 作業中のワーカーがいる場合は残す
+            pass
+
+    def _lease_path(self, unit_id, generation):
+        """リースファイルのパスを生成"""
+        return os.path.join(self.leases_dir, unit_id, str(generation))
+
+    def _current_lease(self, unit_id):
+        """最新世代のリースを取得（リースがない場合は (0, None)）"""
+        # 作業単位ごとのフォルダだけを見るため、作業単位が増えても走査量は変わらない
+        try:
+            names = os.listdir(os.path.join(self.leases_dir, unit_id))
+        except FileNotFoundError:
+            return 0, None
+
+        generation = max((int(name) for name in names if name.isdigit()), default=0)
+
+        if generation == 0:
+            return 0, None
+
+        lease_path = self._lease_path(unit_id, generation)
+        try:
+            return generation, self._read_json(lease_path)
+        except ValueError:
+            # 内容が未書き込みのリースは、作成時刻からリース期間が過ぎるまで有効とみなす
+            return generation, {
+                'worker': None,
+                'expires': os.path.getmtime(lease_path) + self.load_job()['lease_seconds']
+            }
+
+    @staticmethod
+    def _create_exclusive(path, data):
+        """ファイルを排他作成してJSONを書き込む（既に存在する場合はFalse）"""
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        return True
+
+    @staticmethod
+    def _publish_exclusive(path, data):
+        """
+        一時ファイルに書き込んだJSONをハードリンクで排他的に公開（既に存在する場合はFalse）
+
+        公開されたファイルは常に書き込みが完了しているため、完了記録のように
+        存在そのものが意味を持つファイルに使います。
+        """
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    @staticmethod
+    def _write_json(path, data):
+        """一時ファイル経由でJSONをアトミックに書き込む"""
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_json(path):
+        """JSONファイルを読み込む"""
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def _worker_main(job_dir):
+    """ローカルの子プロセスでワーカーを実行"""
+    processed_units, errors = ShardedBatch(job_dir).run_worker()
+    for error in errors:
+        print(f"エラー: {error}")
+    print(f"ワーカー {os.getpid()}: {processed_units}単位を処理しました")
+
+
+def main():
+    """コマンドラインからジョブの作成・実行・進捗確認を行う"""
+    parser = argparse.ArgumentParser(description="共有フォルダを使ったPDF→PNGの分散変換")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="ジョブマニフェストを作成")
+    create_parser.add_argument("job_dir", help="共有ジョブフォルダ")
+    create_parser.add_argument("output_folder", help="出力先フォルダ")
+    create_parser.add_argument("pdf_paths", nargs="+", help="変換するPDFファイル")
+    create_parser.add_argument("--pages-per-unit", type=int, default=20, help="1作業単位あたりのページ数")
+    create_parser.add_argument("--dpi", type=int, default=150, help="解像度")
+    create_parser.add_argument("--lease-seconds", type=int, default=300, help="リースの有効期間（秒）")
+    create_parser.add_argument("--per-document", action="store_true", help="文書ごとにサブフォルダを作成")
+    create_parser.add_argument("--pages-per-folder", type=int, default=None, help="指定したページ数ごとにサブフォルダを分割")
+
+    work_parser = subparsers.add_parser("work", help="ワーカーとして作業単位を処理")
+    work_parser.add_argument("job_dir", help="共有ジョブフォルダ")
+    work_parser.add_argument("--processes", type=int, default=1, help="このマシンで起動するワーカープロセス数")
+
+    status_parser = subparsers.add_parser("status", help="ジョブの進捗を表示")
+    status_parser.add_argument("job_dir", help="共有ジョブフォルダ")
+
+    index_parser = subparsers.add_parser("index", help="完了記録から出力先の索引を作り直す")
+    index_parser.add_argument("job_dir", help="共有ジョブフォルダ")
+
+    args = parser.parse_args()
+    batch = ShardedBatch(args.job_dir)
+
+    if args.command == "create":
+        unit_count = batch.create(
+            args.pdf_paths,
+            args.output_folder,
+            pages_per_unit=args.pages_per_unit,
+            dpi=args.dpi,
+            lease_seconds=args.lease_seconds,
+            layout=OutputLayout(
+                per_document=args.per_document,
+                pages_per_folder=args.pages_per_folder
+            )
+        )
+        print(f"{unit_count}個の作業単位を作成しました: {args.job_dir}")
+
+    elif args.command == "work":
+        batch.load_job()
+        processes = [
+            multiprocessing.Process(target=_worker_main, args=(args.job_dir,))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    elif args.command == "status":
+        status = batch.status()
+        print(f"完了: {status['done']}/{status['total']}（処理中: {status['leased']}）")
+
+    elif args.command == "index":
+        batch.build_index()
+        print(f"索引を作成しました: {os.path.join(batch.load_job()['output_folder'], PageIndex.FILE_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
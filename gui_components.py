@@ -4,6 +4,7 @@ from tkinterdnd2 import DND_FILES, TkinterDnD
 import os
 import threading
 from pdf_processor import PDFProcessor
+from output_layout import OutputLayout, PageIndex
 
 
 class DragDropFrame(tk.Frame):
@@ -168,10 +169,12 @@ class FileListFrame(tk.Frame):
 class ConversionWorker:
     """変換処理を別スレッドで実行するクラス"""
     
-    def __init__(self, root, files, output_folder, progress_callback=None, completion_callback=None):
+    def __init__(self, root, files, output_folder, progress_callback=None, completion_callback=None,
+                 layout=None):
         self.root = root  # rootウィジェットを受け取る
         self.files = files
         self.output_folder = output_folder
+        self.layout = layout  # 出力ファイルの配置（Noneの場合は出力先フォルダ直下）
         self.progress_callback = progress_callback
         self.completion_callback = completion_callback
         self.is_running = False
@@ -189,6 +192,14 @@ class ConversionWorker:
         total_files = len(self.files)
         successful_conversions = 0
         errors = []
+        layout = self.layout or OutputLayout()
+        
+        # 既存の索引を読み込む（読み込めない場合は新しい索引を作り直す）
+        try:
+            index = PageIndex.load(self.output_folder, layout)
+        except Exception as e:
+            errors.append(f"索引ファイルを読み込めないため作り直します: {str(e)}")
+            index = PageIndex(self.output_folder, layout)
         
         for i, file_path in enumerate(self.files):
             if not self.is_running:
@@ -201,13 +212,22 @@ class ConversionWorker:
                     self.root.after(0, lambda i=i, total=total_files, fn=filename: 
                                   self.progress_callback(i, total, f"処理中: {fn}"))
                 
-                page_count = PDFProcessor.pdf_to_png(file_path, self.output_folder)
+                page_count = PDFProcessor.pdf_to_png(
+                    file_path, self.output_folder, layout=layout, index=index
+                )
                 successful_conversions += 1
                 
             except Exception as e:
                 error_msg = f"{os.path.basename(file_path)}: {str(e)}"
                 errors.append(error_msg)
         
+        # 変換済みのページを索引に保存（キャンセル時も完了分は残す）
+        if successful_conversions:
+            try:
+                index.save()
+            except Exception as e:
+                errors.append(f"索引ファイルの保存に失敗しました: {str(e)}")
+        
         # 最終進捗更新（メインスレッドで）
         if self.progress_callback:
             self.root.after(0, lambda: self.progress_callback(total_files, total_files, "完了"))
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import uuid
+
+
+class OutputLayout:
+    """出力PNGファイルの配置（ファイル名の桁数とサブフォルダ分割）を決めるクラス
+
+    デフォルトでは従来通り出力先フォルダ直下に `文書名_001.png` の形式で保存します。
+    ページ番号の桁数は文書のページ数に合わせて広がるため、1000ページ以上の文書でも
+    ファイル名の順序がページ順と一致します。
+    """
+
+    def __init__(self, min_digits=3, per_document=False, pages_per_folder=None):
+        """
+        Args:
+            min_digits (int): ページ番号の最小桁数（デフォルト3）
+            per_document (bool): 文書ごとにサブフォルダを作成するか（デフォルトFalse）
+            pages_per_folder (int): 指定したページ数ごとにサブフォルダを分割（デフォルトは分割しない）
+
+        Raises:
+            ValueError: min_digitsが1未満の場合、またはpages_per_folderが1未満の場合
+        """
+        if min_digits < 1:
+            raise ValueError(f"ページ番号の最小桁数は1以上を指定してください: {min_digits}")
+
+        if pages_per_folder is not None and pages_per_folder < 1:
+            raise ValueError(f"サブフォルダあたりのページ数は1以上を指定してください: {pages_per_folder}")
+
+        self.min_digits = min_digits
+        self.per_document = per_document
+        self.pages_per_folder = pages_per_folder
+
+    def digits(self, page_count):
+        """ページ数に応じたページ番号の桁数を取得"""
+        return max(self.min_digits, len(str(page_count)))
+
+    def relative_path(self, base_name, page_num, page_count):
+        """
+        ページの出力パスを出力先フォルダからの相対パスで取得
+
+        Args:
+            base_name (str): 文書名（PDFファイル名の拡張子なし）
+            page_num (int): ページ番号（0始まり）
+            page_count (int): 文書の総ページ数
+
+        Returns:
+            str: 出力先フォルダからの相対パス
+        """
+        width = self.digits(page_count)
+        parts = []
+
+        if self.per_document:
+            parts.append(base_name)
+
+        if self.pages_per_folder:
+            start = page_num - page_num % self.pages_per_folder
+            end = min(start + self.pages_per_folder, page_count)
+            parts.append(f"{start+1:0{width}d}-{end:0{width}d}")
+
+        parts.append(f"{base_name}_{page_num+1:0{width}d}.png")
+        return os.path.join(*parts)
+
+    def to_dict(self):
+        """設定を辞書に変換（ジョブマニフェストへの保存用）"""
+        return {
+            'min_digits': self.min_digits,
+            'per_document': self.per_document,
+            'pages_per_folder': self.pages_per_folder
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """辞書から設定を復元"""
+        return cls(**data) if data else cls()
+
+
+class PageIndex:
+    """(文書名, ページ番号) から出力ファイルのパス・サイズ・チェックサムを引く索引
+
+    出力先フォルダの `page_index.json` に保存されます。パスは出力配置から計算できるため、
+    索引には出力配置を1回だけ記録し、ページごとには [サイズ, チェックサム] のみを保存します。
+    利用側は索引を1回読み込むだけで、フォルダを走査せずに任意のページの位置を
+    定数時間で取得できます。
+    """
+
+    FILE_NAME = "page_index.json"
+
+    def __init__(self, output_folder, layout=None):
+        """
+        Args:
+            output_folder (str): 出力先フォルダ
+            layout (OutputLayout): 出力ファイルの配置（デフォルトは出力先フォルダ直下）
+        """
+        self.output_folder = output_folder
+        self.layout = layout or OutputLayout()
+        self.documents = {}
+
+    @classmethod
+    def load(cls, output_folder, layout=None):
+        """
+        出力先フォルダの索引を読み込む
+
+        Args:
+            output_folder (str): 出力先フォルダ
+            layout (OutputLayout): これから追加するページの出力配置（省略時は索引に記録された配置を使う）
+
+        Returns:
+            PageIndex: 索引（ファイルがない場合は空の索引）
+
+        Raises:
+            ValueError: 索引ファイルの形式が正しくない場合、または出力配置が索引と異なる場合
+        """
+        index_path = os.path.join(output_folder, cls.FILE_NAME)
+        if not os.path.exists(index_path):
+            return cls(output_folder, layout)
+
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                data = json.load(f)
+            stored_layout = OutputLayout.from_dict(data['layout'])
+            documents = data['documents']
+            cls._validate_documents(documents)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"索引ファイルの形式が正しくありません: {index_path} ({str(e)})")
+
+        if layout is not None and layout.to_dict() != stored_layout.to_dict():
+            raise ValueError(f"索引ファイルの出力配置が指定された出力配置と異なります: {index_path}")
+
+        index = cls(output_folder, stored_layout)
+        index.documents = documents
+        return index
+
+    @staticmethod
+    def _validate_documents(documents):
+        """索引の文書情報の形式を確認（正しくない場合はValueError）"""
+        if not isinstance(documents, dict):
+            raise ValueError("documentsが辞書ではありません")
+
+        for base_name, document in documents.items():
+            if not isinstance(document, dict):
+                raise ValueError(f"{base_name}: 文書情報が辞書ではありません")
+
+            page_count = document.get('page_count')
+            pages = document.get('pages')
+            if not isinstance(page_count, int) or page_count < 0:
+                raise ValueError(f"{base_name}: page_countが正しくありません")
+            if not isinstance(pages, list) or len(pages) != page_count:
+                raise ValueError(f"{base_name}: pagesの長さがpage_countと一致しません")
+
+            for entry in pages:
+                if entry is not None and not (
+                    isinstance(entry, list) and len(entry) == 2
+                    and isinstance(entry[0], int) and isinstance(entry[1], str)
+                ):
+                    raise ValueError(f"{base_name}: ページ情報が [サイズ, チェックサム] の形式ではありません")
+
+    def add(self, base_name, page_num, page_count, file_path):
+        """
+        ページを索引に登録
+
+        Args:
+            base_name (str): 文書名
+            page_num (int): ページ番号（0始まり）
+            page_count (int): 文書の総ページ数
+            file_path (str): サイズとチェックサムを計算するファイル（作業用フォルダ内のファイルでもよい）
+        """
+        self.add_entry(base_name, page_num, page_count, list(self.file_digest(file_path)))
+
+    def add_entry(self, base_name, page_num, page_count, entry):
+        """計算済みの [サイズ, チェックサム] を索引に登録"""
+        document = self.documents.get(base_name)
+        if document is None or document['page_count'] != page_count:
+            document = {'page_count': page_count, 'pages': [None] * page_count}
+            self.documents[base_name] = document
+
+        document['pages'][page_num] = entry
+
+    def lookup(self, base_name, page_number):
+        """
+        ページの出力ファイル情報を取得
+
+        Args:
+            base_name (str): 文書名
+            page_number (int): ページ番号（1始まり、ファイル名の番号と同じ）
+
+        Returns:
+            dict: path, size, checksum を含む辞書（登録されていない場合はNone）
+        """
+        document = self.documents.get(base_name)
+        if document is None or not 1 <= page_number <= document['page_count']:
+            return None
+
+        entry = document['pages'][page_number - 1]
+        if entry is None:
+            return None
+
+        size, checksum = entry
+        relative_path = self.layout.relative_path(base_name, page_number - 1, document['page_count'])
+        return {
+            'path': os.path.join(self.output_folder, relative_path),
+            'size': size,
+            'checksum': checksum
+        }
+
+    def save(self):
+        """索引を一時ファイル経由でアトミックに保存"""
+        index_path = os.path.join(self.output_folder, self.FILE_NAME)
+        tmp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {'version': 1, 'layout': self.layout.to_dict(), 'documents': self.documents},
+                f, ensure_ascii=False, separators=(",", ":")
+            )
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def file_digest(file_path):
+        """ファイルのサイズとSHA-256チェックサムを取得"""
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return os.path.getsize(file_path), sha256.hexdigest()
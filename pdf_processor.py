@@ -1,13 +1,15 @@
 import fitz  # PyMuPDF
 import os
 import pathlib
+from output_layout import OutputLayout
 
 
 class PDFProcessor:
     """PDFファイルをPNG画像に変換するクラス"""
     
     @staticmethod
-    def pdf_to_png(pdf_path, output_folder, dpi=150):
+    def pdf_to_png(pdf_path, output_folder, dpi=150, page_range=None, page_callback=None,
+                   layout=None, index=None):
         """
         PDFファイルを連番PNG画像に変換
         
@@ -15,6 +17,10 @@ class PDFProcessor:
             pdf_path (str): PDFファイルのパス
             output_folder (str): 出力先フォルダ
             dpi (int): 解像度（デフォルト150）
+            page_range (tuple): 変換するページ範囲 (開始, 終了)。0始まり・終了は含まない（デフォルトは全ページ）
+            page_callback (callable): 1ページ保存するごとに (page_num, output_path) で呼ばれる関数
+            layout (OutputLayout): 出力ファイルの配置（デフォルトは出力先フォルダ直下）
+            index (PageIndex): 保存したページを登録する索引（出力配置はlayoutと同じものを使い、保存は呼び出し側で行う）
             
         Returns:
             int: 変換されたページ数
@@ -31,9 +37,13 @@ class PDFProcessor:
         # PDFドキュメントを開く
         doc = fitz.open(pdf_path)
         base_name = pathlib.Path(pdf_path).stem
+        layout = layout or OutputLayout()
         
         try:
-            for page_num in range(len(doc)):
+            start, end = page_range if page_range else (0, len(doc))
+            end = min(end, len(doc))
+            
+            for page_num in range(start, end):
                 page = doc.load_page(page_num)
                 
                 # 解像度を設定してピクスマップを取得
@@ -41,16 +51,21 @@ class PDFProcessor:
                 pix = page.get_pixmap(matrix=mat)
                 
                 # 出力ファイル名を生成
-                output_path = os.path.join(
-                    output_folder, 
-                    f"{base_name}_{page_num+1:03d}.png"
-                )
+                relative_path = layout.relative_path(base_name, page_num, len(doc))
+                output_path = os.path.join(output_folder, relative_path)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
                 
                 # PNG画像として保存
                 pix.save(output_path)
                 pix = None  # メモリ解放
                 
-            return len(doc)
+                if index is not None:
+                    index.add(base_name, page_num, len(doc), output_path)
+                
+                if page_callback:
+                    page_callback(page_num, output_path)
+                
+            return max(end - start, 0)
             
         finally:
             doc.close()